@@ -1,8 +1,57 @@
 import numpy as np
 import sounddevice as sd
 from scipy.io import wavfile
+import scipy.fft
+import functools
+import math
 import os
 
+try:
+    from numba import njit
+except ImportError: #numba is optional, without it the kernels below run as plain Python loops
+    def njit(*args, **kwargs):
+        return lambda func: func
+
+_LN10_OVER_40 = math.log(10) / 40.0 #dB to linear amplitude for half of an ILD
+
+
+@njit(cache=True, fastmath=True, nogil=True, error_model='numpy')
+def _thiran_kernel(x, delay, out):
+    """
+    First order Thiran all-pass, y[n] = a*(x[n] - y[n-1]) + x[n-1] with 
+    a = (1 - delay)/(1 + delay). The magnitude response is flat and the group 
+    delay is exactly 'delay' samples at low frequencies, it is best behaved 
+    for 0.5 <= delay <= 1.5. Safe to run in place (out is x).
+    
+    """
+    a = (1.0 - delay) / (1.0 + delay)
+    x_prev = 0.0
+    y_prev = 0.0
+    for i in range(len(x)):
+        y_prev = a * (x[i] - y_prev) + x_prev
+        x_prev = x[i]
+        out[i] = y_prev
+
+
+@functools.lru_cache(maxsize=16)
+def _make_tone(sample_rate, freq, duration, ramp_ms):
+    """
+    Sine tone with raised cosine on/off ramps. The ramps are applied in place 
+    to the first and last samples only. Cached, so the returned array is 
+    read-only and shared between callers.
+    
+    """
+    n = int(sample_rate * duration)
+    tone = np.sin((2* np.pi * freq / sample_rate) * np.arange(n)).astype(np.float32) #phase step per sample times the sample index, no separate time axis
+    
+    ramp_y = max(1, int(sample_rate * ramp_ms / 1000.0))
+    ramp_val = (0.5 * (1 - np.cos(np.linspace(0, np.pi, ramp_y)))).astype(np.float32)
+    tone[:ramp_y] *= ramp_val
+    tone[-ramp_y:] *= ramp_val[::-1]
+    
+    tone.flags.writeable = False
+    return tone
+
 
 class generate_ITD:
     """
@@ -19,6 +68,22 @@ class generate_ITD:
         self.avg_head_r = avg_head_r
         self.speed_of_sound = speed_of_sound
         
+        #The test tone is fixed across trials, so its spectrum is computed once in play_test_tone and reused by apply_itd.
+        self.tone = None
+        self._tone_spec = None
+        self._tone_peak = None
+        
+        #Stereo renderings of the tone keyed by (angle, use_ild). The staircase angle only changes after a run of correct answers, so most trials reuse a buffer.
+        self._itd_cache = {}
+        self._itd_cache_size = 32
+        self._angle_cache = {} #angle -> (shift_L, shift_R, gain_L, gain_R)
+        
+        #Output stream, opened on the first playback and kept open until close()
+        self.stream = None
+        
+        #Zero padding for the FFT delay: the largest per-ear shift is half of the ITD at 90 degrees, padding by at least that avoids wraparound.
+        self._fft_pad = int(np.ceil(0.5 * self.woodworth_model(90.0) * self.sample_rate)) + 1
+        
     # The Psychoacoustic Model: 
     def woodworth_model(self, angle_deg):
         
@@ -60,17 +125,100 @@ class generate_ITD:
         """
         1D signal is shifted by a fractional (possibly negative) number of samples. 
         Positive shift = delay (moves signal to the right).
-        Uses linear interpolation + zero padding. 
+        The whole samples are shifted by a slice copy + zero padding and the 
+        remaining fraction by a first order Thiran all-pass, which is cheaper 
+        than interpolation and keeps the spectrum flat. 
         Preserves length, avoids wraparound.
         
         """
+        x = np.ascontiguousarray(x, dtype = np.float32)
         n = len(x)
-        t = np.arange(n)
-        t_src = t - sample_shift
+        y = np.zeros(n, dtype = np.float32)
+        
+        k = math.floor(sample_shift)
+        frac = sample_shift - k
+        if 0.0 < frac < 0.5:
+            #keep the all-pass delay within 0.5 to 1.5 samples where it is accurate and well damped
+            frac += 1.0
+            k -= 1
+        
+        if k >= 0 and k < n:
+            y[k:] = x[:n - k]
+        elif k < 0 and -k < n:
+            y[:n + k] = x[-k:]
         
-        y = np.interp(t_src, t, x, left=0.0, right =0.0) #linear interpolation allows us to prevent the signal from having warps or artifacts while preserving the signal length.
+        if frac > 0.0:
+            _thiran_kernel(y, frac, y)
         return y
     
+    def _fft_len (self, n):
+        """FFT length for an n sample signal: padded against wraparound, then rounded up to a size with only small prime factors (fast FFT, and scipy.fft reuses its cached plan for it)"""
+        return scipy.fft.next_fast_len(n + self._fft_pad, real = True)
+    
+    def _render_stereo (self, x, shift_left, shift_right, gain_left, gain_right):
+        
+        """
+        Renders both ears of a mono signal in one go. Each ear is delayed in 
+        the frequency domain by a linear phase ramp exp(-j*2*pi*f*shift) with 
+        its ILD gain folded into the same multiply, and a single inverse FFT 
+        over both columns writes the contiguous [N, 2] output. The phase ramp 
+        is an ideal (band-limited) fractional delay, so there is no high 
+        frequency droop as with linear interpolation. The signal is zero 
+        padded before the FFT so the shifted samples do not wrap around.
+        
+        """
+        n = len(x)
+        gains = np.array([gain_left, gain_right], dtype = np.float32)
+        if shift_left == 0.0 and shift_right == 0.0:
+            #nothing to delay (centred source), the ears are just scaled copies
+            stereo_signal = np.empty((n, 2), dtype = np.float32)
+            np.multiply(np.asarray(x, dtype = np.float32)[:, None], gains, out = stereo_signal)
+            return stereo_signal
+        
+        nfft = self._fft_len(n)
+        if x is self.tone and self._tone_spec is not None:
+            spec = self._tone_spec
+        else:
+            spec = scipy.fft.rfft(x, nfft, workers = -1)
+        
+        freqs = np.fft.rfftfreq(nfft).astype(np.float32)[:, None]
+        shifts = np.array([shift_left, shift_right], dtype = np.float32)
+        
+        spec_lr = (spec[:, None] * gains) * np.exp((-2j * np.pi) * freqs * shifts)
+        return scipy.fft.irfft(spec_lr, nfft, axis = 0, workers = -1)[:n]
+    
+    def _itd_params (self, angle_deg):
+        
+        """
+        Per-ear sample shifts and ILD gains for an angle, returned as 
+        (shift_L, shift_R, gain_L, gain_R). The staircase only visits a few 
+        distinct angles, so these are computed once per angle and cached.
+        
+        """
+        params = self._angle_cache.get(angle_deg)
+        if params is not None:
+            return params
+        
+        itd_sec = self.woodworth_model(angle_deg)
+        d_samples = itd_sec * self.sample_rate
+        
+        #interaural delat is split equally to presever global onset of the sound.
+        #d_samples keeps the sign of the angle: source to the right (d > 0) delays the left ear and advances the right, and the other way round for d < 0.
+        shift_L = +0.5 * d_samples
+        shift_R = -0.5 * d_samples
+        
+        ild = float(self.simple_ild(angle_deg))
+        
+        #the ILD is split equally between the ears, 10**(ild/40) written as exp so the left gain is just its reciprocal
+        increase_R = math.exp(ild * _LN10_OVER_40)
+        increase_L = 1.0 / increase_R
+        
+        if len(self._angle_cache) >= self._itd_cache_size:
+            del self._angle_cache[next(iter(self._angle_cache))]
+        params = (shift_L, shift_R, increase_L, increase_R)
+        self._angle_cache[angle_deg] = params
+        return params
+    
     def apply_itd(self, mono_signal, angle_deg, use_ild = True):
         
         """
@@ -82,43 +230,39 @@ class generate_ITD:
         left delayed by +d/2, right by -d/2.
         
         """
-        mono_sound = np.asarray(mono_signal, dtype = float)
-        itd_sec = self.woodworth_model(angle_deg)
-        d_samples = itd_sec * self.sample_rate
-        
-        #interaural delat is split equally to presever global onset of the sound.
-        shift_left = +0.5 * abs(d_samples)
-        shift_right = -0.5 * abs(d_samples)
-        
-        if angle_deg >= 0:
-            #Source position to the right while left is delayed
-            
-            left = self.fractional_shift(mono_sound, +shift_left)
-            right = self.fractional_shift(mono_sound, +shift_right)
-            
+        if mono_signal is self.tone:
+            key = (round(angle_deg, 4), use_ild)
+            if key in self._itd_cache:
+                return self._itd_cache[key]
+            mono_sound = self.tone #keep the identity so the cached spectrum of the tone is used
         else:
-            #Source position to the left while right is delayed
-            left = self.fractional_shift(mono_sound, +shift_right)
-            right = self.fractional_shift(mono_sound, +shift_left)
-            
+            key = None
+            mono_sound = np.asarray(mono_signal, dtype = np.float32)
+        shift_L, shift_R, increase_L, increase_R = self._itd_params(angle_deg)
         
         #This is a simple ILD manipulation/ (optional)
-        if use_ild:
-            ild = self.simple_ild(angle_deg)
-            
-            increase_R = 10 ** ( (+ild / 20.0) / 2.0)
-            increase_L = 10 ** ((-ild / 20.0 )/ 2.0)
-            right *= increase_R
-            left *= increase_L
-            
-            
-            stereo_signal = np.column_stack([left,right])
+        if not use_ild:
+            increase_L = increase_R = 1.0
             
-            #Apply peak normalisation in order to avoid clipping and preserve ILD cues.
+        #Delays, gains and stereo packing are fused into one [N, 2] float32 rendering, sounddevice plays float32 natively.
+        stereo_signal = self._render_stereo(mono_sound, shift_L, shift_R, increase_L, increase_R)
+        
+        #Apply peak normalisation in order to avoid clipping and preserve ILD cues.
+        #An unshifted rendering of the tone is just the tone times the gains, so its peak is known without scanning the buffer (usually <= 1 and normalisation is skipped).
+        #Shifted renderings are band-limited interpolations that can overshoot the tone's samples slightly, so they are still scanned.
+        if mono_sound is self.tone and shift_L == 0.0 and shift_R == 0.0:
+            peak_norm = max(increase_L, increase_R) * self._tone_peak
+        else:
             peak_norm = np.max(np.abs(stereo_signal))
-            if peak_norm > 1.0:
-                stereo_signal = stereo_signal / peak_norm
-            return stereo_signal
+        if peak_norm > 1.0:
+            np.multiply(stereo_signal, 1.0 / peak_norm, out = stereo_signal)
+        
+        if key is not None:
+            if len(self._itd_cache) >= self._itd_cache_size:
+                del self._itd_cache[next(iter(self._itd_cache))] #evict the oldest rendering
+            stereo_signal.flags.writeable = False #the same buffer is handed out on every hit, so it must not be modified in place
+            self._itd_cache[key] = stereo_signal
+        return stereo_signal
         
     
     #Generate a simple test tone, play and save the sound stimuli as a wavfile.
@@ -130,34 +274,43 @@ class generate_ITD:
         Then a 10 ms cosine ramp is added ( a slight fade-in/out effect) to avoid clicks in the tone generated. 
         The sound stimulus is returned as an array."""
         
-        n = int(self.sample_rate * duration)
-        t = np.arange(n) / self.sample_rate
-        t_tone = np.sin(2* np.pi * freq * t )
-        
         #Here we apply an on/off ramp of about 10ms
-        ramp_x = 0.01
-        ramp_y = max(1, int(self.sample_rate * ramp_x))
-        window = np.ones(n)
-        ramp_val = 0.5 * (1 - np.cos(np.linspace(0, np.pi, ramp_y)))
-        window [:ramp_y] *= ramp_val
-        window[-ramp_y:] *= ramp_val[::-1]
-        
-        return t_tone * window
+        tone = _make_tone(self.sample_rate, freq, duration, 10.0)
+        if tone is not self.tone:
+            self.tone = tone
+            self._itd_cache.clear()
+            self._tone_spec = scipy.fft.rfft(self.tone, self._fft_len(len(self.tone)), workers = -1)
+            self._tone_peak = float(np.max(np.abs(self.tone)))
+        return self.tone
     
     def tt_playback (self, stereo_signal):
         """ Playback of the test tone"""
         
-        stereo_signal = np.asarray(stereo_signal, dtype=float)
+        #apply_itd already returns contiguous float32, only convert other input
+        if not isinstance(stereo_signal, np.ndarray) or stereo_signal.dtype != np.float32 or not stereo_signal.flags.c_contiguous:
+            stereo_signal = np.ascontiguousarray(stereo_signal, dtype=np.float32)
         
         if stereo_signal.ndim != 2 or stereo_signal.shape[1] !=2:
             raise ValueError("Input signal should be in stereo (Nx2)")
-        sd.play(stereo_signal, self. sample_rate, blocking=True)
+        
+        #One low latency stream is reused for every tone instead of opening and closing PortAudio on each sd.play call.
+        if self.stream is None:
+            self.stream = sd.OutputStream(samplerate=self.sample_rate, channels=2, dtype='float32', latency='low', blocksize=512)
+            self.stream.start()
+        self.stream.write(stereo_signal)
+    
+    def close (self):
+        """Let the queued audio finish and release the output stream"""
+        if self.stream is not None:
+            self.stream.stop()
+            self.stream.close()
+            self.stream = None
         
     
     def save_soundfile (self, stereo_signal, filename):
         """Save the generated tone to the directory"""
         os.makedirs(os.path.dirname(filename) or ".", exist_ok =True)
-        x = np.asarray(stereo_signal, dtype=float)
+        x = np.asarray(stereo_signal, dtype=np.float32)
         peak_norm = np.max(np.abs(x))
         if peak_norm > 0:
             x = x / peak_norm * 0.95 #here we have multiplied the normalisation by 0.95 to leave "headroom". This avoids the loudest parts of the sound being too harsh (distorted or clipping) while maintaining the signal at a safe level.
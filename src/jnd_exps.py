@@ -1,5 +1,6 @@
 import random
 import time
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import matplotlib.pyplot as plt
 from itd_generate import generate_ITD
@@ -18,6 +19,11 @@ class jnd_experiment:
     def __init__ (self, max_trials = 10, start_angle = 10.0, min_angle = 0.0, max_angle = 90.0):
         self.generator = generate_ITD()
         self.tone = self.generator.play_test_tone(duration = 0.2)
+        self.reference = self.generator.apply_itd(self.tone, 0) #the centred reference sound is the same in every trial
+        
+        #The next trial's sounds are rendered in the background while the participant answers
+        self._executor = ThreadPoolExecutor(max_workers = 1)
+        self._pending_next = []
         
         #staircase param
         self.angle  = start_angle
@@ -33,32 +39,26 @@ class jnd_experiment:
         self.history_angle = []
         self.history_correct = []
         
-        #plotting performance in each trial
-        plt.ion()
-        self.fig, self.ax = plt.subplots(figsize=(8,4))
-        self.line, = self.ax.plot([],[],'-o', label = 'angle mag in deg')
-        self.scatter = None
-        self.ax.set_xlabel('Trial')
-        self.ax.set_ylabel('diff in angle')
-        self.ax.set_title ('Localisation Perfromance in each Trial')
-        self.ax.legend()
-        self.ax.set_ylim(0, max_angle * 1.1)
-        
     def trial_run(self):
         
-    """Here we run the experiment as a 2 Alternative-Forced-Choice Trial"""
+        """Here we run the experiment as a 2 Alternative-Forced-Choice Trial"""
+        
+        #The generator is not shared across threads, wait for the prefetch before using it
+        for fut in self._pending_next:
+            fut.result()
+        self._pending_next = []
         
         target_angle = random.choice([-1,1]) * self.angle
         
         
         order = random.choice ([0, 1])
         if order == 0:
-            sound_a = self.generator.apply_itd(self.tone, 0)
+            sound_a = self.reference
             sound_b = self.generator.apply_itd(self.tone, target_angle)
             correct_response = '2' if target_angle < 0 else '1'
         else:
             sound_a = self.generator.apply_itd(self.tone, target_angle)
-            sound_b = self.generator.apply_itd(self.tone, 0)
+            sound_b = self.reference
             correct_response = '1' if target_angle <0 else '2'
             
         
@@ -69,6 +69,7 @@ class jnd_experiment:
         self.generator.tt_playback(sound_b)
         time.sleep(0.2)
         
+        self.prefetch_next()
         
         #Get responses from the participant 
         pp_response = input (" Which sound did you perceive as further to your left? 1 = first 2 = second: ").strip()
@@ -89,11 +90,23 @@ class jnd_experiment:
         self.history_angle.append(target_angle)
         self.history_correct.append(is_correct)
         
-        #Update the plot
-        self.update_plot()
-        
         return is_correct, target_angle
         
+    def prefetch_next(self):
+        """
+        The next angle only depends on whether this answer is correct (see 
+        the staircase update in trial_run), so both candidates are rendered 
+        with either sign into the generator's cache during the response time.
+        
+        """
+        next_angles = [self.angle]
+        if self.correct_streak + 1 >= 2:
+            next_angles.append(min(self.max_angle, self.angle * 1.25))
+        
+        for angle in next_angles:
+            for sign in (-1, 1):
+                self._pending_next.append(self._executor.submit(self.generator.apply_itd, self.tone, sign * angle))
+    
     def adjust_angle (self, difficulty):
         old_angle = self.angle
         if difficulty:
@@ -115,30 +128,41 @@ class jnd_experiment:
         print("Please use headphones for this experiment. Identify out of the two sounds presented which was further to your LEFT. Respond whether it's the first or second")
 
         trial = 0
-        while trial < self.max_trials and self.reversals < 10:
-            correct, angle = self.trial_run()
-            print(f"Trial {trial+1}: {'✓ Correct' if correct else '✗ Incorrect'} (angle {angle:.2f}°)")
-            trial += 1
+        try:
+            while trial < self.max_trials and self.reversals < 10:
+                correct, angle = self.trial_run()
+                print(f"Trial {trial+1}: {'✓ Correct' if correct else '✗ Incorrect'} (angle {angle:.2f}°)")
+                trial += 1
+        finally:
+            self._executor.shutdown(wait = True, cancel_futures = True)
+            self.generator.close()
 
         print("\nExperiment is now complete.")
-        plt.ioff()
-        plt.show()
+        self.plot_results()
         return self.history_angle, self.history_correct
 
-    def update_plot(self):
+    def plot_results(self):
+        """
+        Plot the localisation performance in each trial once the experiment 
+        is over. This is not drawn live, the participant should not get 
+        feedback during the trials and redrawing after every trial only 
+        delays the next one.
+        
+        """
         trials = np.arange(1, len(self.history_angle)+1)
         abs_angles = np.abs(self.history_angle)
-
-        self.line.set_data(trials, abs_angles)
-        if self.scatter:
-            self.scatter.remove()
-
         colors = ["green" if c else "red" for c in self.history_correct]
-        self.scatter = self.ax.scatter(trials, abs_angles, c=colors, s=60, zorder=3)
 
-        self.ax.set_xlim(0, len(trials)+1)
-        self.ax.figure.canvas.draw()
-        self.ax.figure.canvas.flush_events()
+        fig, ax = plt.subplots(figsize=(8,4))
+        ax.plot(trials, abs_angles, '-o', label = 'angle mag in deg')
+        ax.scatter(trials, abs_angles, c=colors, s=60, zorder=3)
+        ax.set_xlabel('Trial')
+        ax.set_ylabel('diff in angle')
+        ax.set_title ('Localisation Perfromance in each Trial')
+        ax.legend()
+        ax.set_xlim(0, len(trials)+1)
+        ax.set_ylim(0, self.max_angle * 1.1)
+        plt.show()
 
 
 if __name__ == "__main__":